@@ -7,88 +7,482 @@ Processes audio files from TCR-Verbio directory and sends to TalkIntel AI for tr
 import os
 import sys
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import math
+import random
 import time
-from pathlib import Path
 from typing import Optional, Dict, Any
 import argparse
 from urllib.parse import quote
+import io
 import subprocess
-import tempfile
+import threading
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import orjson  # Optional: faster parsing of large diarization responses
+except ImportError:
+    orjson = None
+
+try:
+    import av  # Optional: transcode in-process with libav instead of an FFmpeg subprocess
+except ImportError:
+    av = None
+
+# HTTP statuses worth retrying (rate limit / transient server errors)
+RETRIABLE_STATUS = {429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 5
+# Exponential backoff between attempts: 1.5s, 3s, 6s, ... capped, plus jitter
+BACKOFF_BASE = 1.5
+BACKOFF_MAX = 60
+# Webhook deliveries allowed to wait for the delivery thread before workers block
+WEBHOOK_QUEUE_SIZE = 32
+# Size of the chunks read from FFmpeg's stdout and sent in the upload body
+CHUNK_SIZE = 64 * 1024
+# Seconds FFmpeg may go without producing output while the upload waits on it
+# before the process is killed
+FFMPEG_TIMEOUT = 300
+# Last lines of FFmpeg stderr kept for the failure report
+FFMPEG_STDERR_LINES = 20
+
+# Upload formats FFmpeg can produce: encoder arguments (CLI and PyAV),
+# container, MIME type and the ffprobe codec name of files that can be
+# sent unconverted
+_ENCODINGS = {
+    'mp3': {
+        'args': [
+            '-acodec', 'libmp3lame',  # Use LAME MP3 encoder
+            '-ab', '128k',            # 128kbps bitrate
+            '-write_xing', '0',       # Xing header needs a seekable output
+        ],
+        'av_codec': 'libmp3lame',
+        'av_options': {'b': '128k'},
+        'format': 'mp3',
+        'mime': 'audio/mpeg',
+        'codec_name': 'mp3',
+    },
+    'flac': {
+        'args': [
+            '-acodec', 'flac',             # Lossless, no MP3 artifacts for the ASR
+            '-compression_level', '5',
+        ],
+        'av_codec': 'flac',
+        'av_options': {'compression_level': '5'},
+        'format': 'flac',
+        'mime': 'audio/flac',
+        'codec_name': 'flac',
+    },
+}
+
+# Request parameters from the working curl command - essential for webhook format compatibility
+_INSIGHTS = {
+    "summarization": True,
+    "topic_detection": {"topics": []},
+    "sentiment_analysis": {
+        "sentiments": [
+            "alegria", "confiança", "medo", "surpresa", "tristeza", "repugnância", 
+            "raiva", "antecipação", "neutro", "frustração", "satisfação", 
+            "empolgação", "decepção", "curiosidade", "amor", "ódio", "tédio", 
+            "confusão", "constrangimento", "culpa"
+        ]
+    },
+    "custom": [
+        {
+            "type": "string",
+            "title": "agent",
+            "description": "Identifique o nome do agente se houver sido falado."
+        },
+        {
+            "type": "string", 
+            "title": "client",
+            "description": "Identifique o nome do cliente se tiver sido falado"
+        },
+        {
+            "type": "boolean",
+            "title": "resolution", 
+            "description": "O problema foi resolvido?"
+        }
+    ]
+}
+
+_ANONYMIZE = {
+    "sequence": 3,
+    "entities": ["CNPJ", "CPF", "CREDIT_CARD", "LOCATION"]
+}
+
+# Serialized once at import time, they are identical for every file
+_INSIGHTS_ENCODED = quote(json.dumps(_INSIGHTS))
+_ANONYMIZE_ENCODED = quote(json.dumps(_ANONYMIZE))
+_PRESET_URL_TAIL = (
+    "?model=pulse-precision&language=pt&response_format=diarization"
+    f"&insights={_INSIGHTS_ENCODED}&anonymize={_ANONYMIZE_ENCODED}"
+)
+_CUSTOM_PARAMS = {
+    'model': 'pulse-precision',
+    'language': 'pt',
+    'response_format': 'diarization',
+    'insights': json.dumps(_INSIGHTS),
+    'anonymize': json.dumps(_ANONYMIZE)
+}
+
+def _json_loads(data: bytes) -> Any:
+    """Parse JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
+
+def _transcode_inproc(path: str, audio_format: str = 'mp3') -> bytes:
+    """
+    Transcode the first audio stream of a file to 16kHz mono in the upload
+    format with PyAV, returning the encoded file contents
+    """
+    encoding = _ENCODINGS[audio_format]
+    output = io.BytesIO()
+    with av.open(path) as source, av.open(output, 'w', format=encoding['format']) as target:
+        source_stream = source.streams.audio[0]
+        target_stream = target.add_stream(encoding['av_codec'], rate=16000, options=encoding['av_options'])
+        target_stream.codec_context.layout = 'mono'
+        
+        # The encoder resamples to its rate/layout/sample format and frame size
+        for frame in source.decode(source_stream):
+            frame.pts = None
+            target.mux(target_stream.encode(frame))
+        target.mux(target_stream.encode(None))
+    return output.getvalue()
+
+def _backoff_delay(attempt: int, response: Optional[requests.Response] = None) -> float:
+    """
+    Seconds to wait after a failed attempt (1-based). Honors a numeric
+    Retry-After header, otherwise backs off exponentially with jitter so
+    parallel workers don't retry in lockstep.
+    """
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.isdigit():
+        return min(BACKOFF_MAX, int(retry_after))
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) + random.uniform(0, 0.5)
+
+# When a recording exists in several formats the lowest number wins
+_AUDIO_PRIORITY = {'.mp3': 0, '.wav': 1, '.flac': 2, '.m4a': 3, '.ogg': 4, '.wma': 5}
+_AUDIO_EXT = frozenset(_AUDIO_PRIORITY)
+
+def _iter_audio(root: str):
+    """
+    Yield (base_name, extension, path) for every audio file below root.
+    Uses os.scandir, which reports entry types without an extra stat per file.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            # Unreadable, removed during the scan, or not a directory at all
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    name = entry.name
+                    dot = name.rfind('.')
+                    if dot <= 0:
+                        continue
+                    extension = name[dot:].lower()
+                    if extension in _AUDIO_EXT:
+                        yield name[:dot], extension, entry.path
+
+def _probe(path: str) -> dict:
+    """
+    Return codec_name, channels and sample_rate of the first audio stream
+    as reported by ffprobe, or an empty dict if it cannot be determined
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,channels,sample_rate',
+        '-of', 'json',
+        path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=5)
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return {}
+    
+    if result.returncode != 0:
+        return {}
+    
+    try:
+        streams = json.loads(result.stdout).get('streams', [])
+    except ValueError:
+        return {}
+    return streams[0] if streams else {}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter: allows bursts of up to `burst`
+    requests, then `rate_per_sec` requests per second on average
+    """
+    def __init__(self, rate_per_sec: float, burst: int = 1):
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take one token, sleeping only as long as it takes to refill one"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_sec)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate_per_sec
+            time.sleep(wait_seconds)
+
+class FFmpegError(Exception):
+    """FFmpeg was killed or failed while its output was being uploaded"""
+
+class FFmpegStream:
+    """
+    Running FFmpeg conversion whose output is consumed with `read`. stderr is
+    drained on a background thread so FFmpeg never blocks on a full pipe,
+    and a watchdog kills the process if a read waits more than `timeout`
+    seconds for output. Time the upload spends sending data is not counted.
+    """
+    def __init__(self, cmd: list, file_name: str = '', timeout: Optional[float] = None):
+        self.file_name = file_name  # For log messages
+        self.timeout = timeout or FFMPEG_TIMEOUT
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.stdout = self.process.stdout
+        self.timed_out = False
+        self._stderr = deque(maxlen=FFMPEG_STDERR_LINES)
+        self._reader = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._reader.start()
+        self._read_started = None  # monotonic time of the read in progress
+        self._closed = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+    
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self._stderr.append(line)
+        self.process.stderr.close()
+    
+    def _watch(self):
+        while not self._closed.wait(min(1.0, self.timeout / 2)):
+            started = self._read_started
+            if started is not None and time.monotonic() - started > self.timeout:
+                self._kill()
+                return
+    
+    def _kill(self):
+        if self.process.poll() is None:
+            self.timed_out = True
+            self.process.kill()
+    
+    def _wait(self) -> int:
+        try:
+            return self.process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self._kill()
+            return self.process.wait()
+    
+    def read(self, size: int) -> bytes:
+        """
+        Read up to `size` bytes of output, b'' once FFmpeg finished cleanly
+        
+        Raises:
+            FFmpegError: FFmpeg stalled and was killed, or exited with an error
+        """
+        self._read_started = time.monotonic()
+        try:
+            chunk = self.stdout.read(size)
+        finally:
+            self._read_started = None
+        
+        if not chunk:
+            # EOF: only a clean exit means the output is complete
+            returncode = self._wait()
+            if self.timed_out:
+                raise FFmpegError(f"no output for {self.timeout:g} seconds, killed")
+            if returncode != 0:
+                raise FFmpegError(f"exited with code {returncode}")
+        return chunk
+    
+    @property
+    def stderr(self) -> str:
+        """Tail of FFmpeg's stderr output"""
+        return b''.join(self._stderr).decode('utf-8', errors='replace')
+    
+    def close(self) -> int:
+        """Stop reading, wait for FFmpeg to exit and return its exit code"""
+        # Closing stdout unblocks FFmpeg if the upload stopped reading early
+        self.stdout.close()
+        self._wait()
+        self._closed.set()
+        self._reader.join()
+        return self.process.returncode
 
 class TalkIntelTranscriber:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, concurrency: int = 4, max_workers: int = 4, audio_format: str = 'mp3', rate_limit: float = 0.5):
         self.api_key = api_key
         self.base_url = "https://api.sippulse.ai"
+        # Upload format, see _ENCODINGS; drops back to MP3 if the server rejects it
+        self.audio_format = audio_format
         self.session = requests.Session()
         self.session.headers.update({
             'api-key': api_key,
             'accept': 'application/json'
         })
+        # Default worker count for the batch methods; the connection pool is sized to it
+        self.max_workers = max_workers
+        self._size_pool(max_workers)
+        # Separate keep-alive session for webhook deliveries, so the
+        # SipPulse api-key header is never sent to the webhook endpoint
+        self.webhook_session = requests.Session()
+        # Caps simultaneous requests to the ASR endpoint (provider concurrency quota)
+        self._inflight = threading.BoundedSemaphore(concurrency)
+        # Paces new requests to the provider's request rate (None = unlimited)
+        self._bucket = TokenBucket(rate_limit, burst=concurrency) if rate_limit > 0 else None
     
-    def convert_audio_with_ffmpeg(self, input_file: str) -> Optional[str]:
+    def _size_pool(self, max_workers: int):
+        """
+        Mount a connection pool with one connection per worker; the requests
+        default of 10 would open and discard extra connections above 10
+        workers, and a smaller blocking pool would leave workers waiting
         """
-        Convert audio file to proper MP3 format using FFmpeg
+        self._pool_size = max_workers
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def is_target_format(self, input_file: str, audio_format: str = 'mp3') -> bool:
+        """
+        Check whether an audio file is already 16kHz mono in the given
+        upload format, as open_ffmpeg_stream would produce it
         
         Args:
             input_file: Path to input audio file
+            audio_format: Upload format, a key of _ENCODINGS
             
         Returns:
-            Path to converted file or None if failed
+            True if the file can be uploaded without conversion
         """
-        try:
-            # Create temporary file for converted audio
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                output_file = temp_file.name
-            
-            print(f"🔄 Converting audio with FFmpeg: {os.path.basename(input_file)}")
-            
-            # FFmpeg command to convert to MP3 with proper encoding
-            cmd = [
-                'ffmpeg',
-                '-i', input_file,
-                '-acodec', 'libmp3lame',  # Use LAME MP3 encoder
-                '-ab', '128k',            # 128kbps bitrate
-                '-ar', '16000',           # 16kHz sample rate (good for speech)
-                '-ac', '1',               # Mono channel
-                '-y',                     # Overwrite output file
-                output_file
-            ]
-            
-            # Run FFmpeg conversion
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                timeout=60  # 1 minute timeout
-            )
+        # Only files with the format's extension can match, don't pay for an ffprobe run on the rest
+        if not input_file.lower().endswith('.' + audio_format):
+            return False
+        
+        stream = _probe(input_file)
+        return (
+            stream.get('codec_name') == _ENCODINGS[audio_format]['codec_name']
+            and stream.get('channels') == 1
+            and stream.get('sample_rate') == '16000'
+        )
+    
+    def open_ffmpeg_stream(self, input_file: str, audio_format: str = 'mp3') -> Optional[FFmpegStream]:
+        """
+        Start FFmpeg converting an audio file to the upload format on its stdout
+        
+        Args:
+            input_file: Path to input audio file
+            audio_format: Upload format, a key of _ENCODINGS
             
-            if result.returncode == 0:
-                print(f"✅ Audio converted successfully")
-                return output_file
-            else:
-                print(f"❌ FFmpeg conversion failed:")
-                print(f"   stdout: {result.stdout}")
-                print(f"   stderr: {result.stderr}")
-                # Clean up failed conversion file
-                if os.path.exists(output_file):
-                    os.unlink(output_file)
-                return None
-                
-        except subprocess.TimeoutExpired:
-            print(f"❌ FFmpeg conversion timed out")
-            if 'output_file' in locals() and os.path.exists(output_file):
-                os.unlink(output_file)
-            return None
+        Returns:
+            Running FFmpeg stream or None if it could not be started
+        """
+        file_name = os.path.basename(input_file)
+        print(f"🔄 Converting audio with FFmpeg: {file_name}")
+        
+        encoding = _ENCODINGS[audio_format]
+        
+        # FFmpeg command to convert to speech-friendly 16kHz mono
+        cmd = [
+            'ffmpeg',
+            '-nostdin',               # Never read from the terminal
+            '-loglevel', 'error',     # Only report problems on stderr
+            '-i', input_file,
+            '-map', '0:a:0',          # First audio stream only, skip cover art/video decoding
+            '-map_metadata', '-1',    # Don't copy tags into the upload
+            *encoding['args'],
+            '-ar', '16000',           # 16kHz sample rate (good for speech)
+            '-ac', '1',               # Mono channel
+            '-f', encoding['format'], # Output container (no file extension to guess from)
+            'pipe:1'                  # Write to stdout
+        ]
+        
+        try:
+            return FFmpegStream(cmd, file_name)
         except FileNotFoundError:
             print(f"❌ FFmpeg not found. Please install FFmpeg first.")
             return None
         except Exception as e:
-            print(f"❌ Unexpected error during conversion: {e}")
-            if 'output_file' in locals() and os.path.exists(output_file):
-                os.unlink(output_file)
+            print(f"❌ Unexpected error during conversion of {file_name}: {e}")
             return None
     
+    def close_ffmpeg_stream(self, stream: FFmpegStream) -> bool:
+        """
+        Wait for an FFmpeg stream to finish and report its outcome
+        
+        Args:
+            stream: FFmpeg stream started by open_ffmpeg_stream
+            
+        Returns:
+            True if the conversion succeeded, False otherwise
+        """
+        returncode = stream.close()
+        
+        if stream.timed_out:
+            print(f"❌ FFmpeg conversion stalled and was killed: {stream.file_name}")
+            return False
+        
+        if returncode == 0:
+            print(f"✅ Audio converted successfully: {stream.file_name}")
+            return True
+        
+        print(f"❌ FFmpeg conversion failed: {stream.file_name}")
+        print(f"   stderr: {stream.stderr}")
+        return False
+    
+    def _multipart_body(self, file_name: str, stream, boundary: str, content_type: str = 'audio/mpeg', prefix: bytes = b''):
+        """
+        Yield a multipart/form-data body for a single 'file' field, reading
+        the file contents from a binary stream in CHUNK_SIZE pieces after
+        any prefix already read from it. A FFmpegError raised by the stream
+        propagates, so a truncated upload is aborted instead of completed.
+        """
+        # Same escaping as urllib3's format_multipart_header_param (HTML5 style)
+        safe_name = file_name.translate({10: '%0A', 13: '%0D', 34: '%22'})
+        yield (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{safe_name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        
+        if prefix:
+            yield prefix
+        
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        
+        yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    
     def transcribe_file(self, audio_file_path: str, use_preset: bool = True) -> Optional[Dict[Any, Any]]:
         """
         Send audio file to TalkIntel AI for transcription
@@ -100,173 +494,161 @@ class TalkIntelTranscriber:
         Returns:
             API response as dictionary or None if failed
         """
-        if not os.path.exists(audio_file_path):
+        try:
+            file_size = os.stat(audio_file_path).st_size
+        except FileNotFoundError:
             print(f"❌ File not found: {audio_file_path}")
             return None
             
-        # Convert audio file with FFmpeg first
-        converted_file = self.convert_audio_with_ffmpeg(audio_file_path)
-        if not converted_file:
-            print(f"❌ Failed to convert audio file: {audio_file_path}")
-            return None
-        
-        # Use converted file for processing
-        actual_file_path = converted_file
         file_name = os.path.basename(audio_file_path)  # Keep original name for display
-        file_size = os.path.getsize(actual_file_path)
-        print(f"🎵 Processing: {file_name} ({file_size:,} bytes converted)")
+        print(f"🎵 Processing: {file_name} ({file_size:,} bytes original)")
+        
+        # Files already in the target format are uploaded as-is
+        audio_format = self.audio_format
+        needs_conversion = not self.is_target_format(audio_file_path, audio_format)
+        if not needs_conversion:
+            print(f"⏩ Already 16kHz mono {audio_format.upper()}, skipping FFmpeg conversion")
         
         # Prepare the request
         if use_preset:
-            # Use the full parameters from your working curl command - essential for webhook format compatibility
-            insights = {
-                "summarization": True,
-                "topic_detection": {"topics": []},
-                "sentiment_analysis": {
-                    "sentiments": [
-                        "alegria", "confiança", "medo", "surpresa", "tristeza", "repugnância", 
-                        "raiva", "antecipação", "neutro", "frustração", "satisfação", 
-                        "empolgação", "decepção", "curiosidade", "amor", "ódio", "tédio", 
-                        "confusão", "constrangimento", "culpa"
-                    ]
-                },
-                "custom": [
-                    {
-                        "type": "string",
-                        "title": "agent",
-                        "description": "Identifique o nome do agente se houver sido falado."
-                    },
-                    {
-                        "type": "string", 
-                        "title": "client",
-                        "description": "Identifique o nome do cliente se tiver sido falado"
-                    },
-                    {
-                        "type": "boolean",
-                        "title": "resolution", 
-                        "description": "O problema foi resolvido?"
-                    }
-                ]
-            }
-            
-            anonymize = {
-                "sequence": 3,
-                "entities": ["CNPJ", "CPF", "CREDIT_CARD", "LOCATION"]
-            }
-            
-            # Build the full URL with all parameters as in your working curl command, properly URL encoded
-            insights_encoded = quote(json.dumps(insights))
-            anonymize_encoded = quote(json.dumps(anonymize))
-            
-            url = f"{self.base_url}/asr/transcribe?model=pulse-precision&language=pt&response_format=diarization&insights={insights_encoded}&anonymize={anonymize_encoded}"
+            # Use the full parameters from your working curl command, properly URL encoded
+            url = self.base_url + "/asr/transcribe" + _PRESET_URL_TAIL
             params = None
         else:
             # Custom parameters as in your curl command
-            insights = {
-                "summarization": True,
-                "topic_detection": {"topics": []},
-                "sentiment_analysis": {
-                    "sentiments": [
-                        "alegria", "confiança", "medo", "surpresa", "tristeza", "repugnância", 
-                        "raiva", "antecipação", "neutro", "frustração", "satisfação", 
-                        "empolgação", "decepção", "curiosidade", "amor", "ódio", "tédio", 
-                        "confusão", "constrangimento", "culpa"
-                    ]
-                },
-                "custom": [
-                    {
-                        "type": "string",
-                        "title": "agent",
-                        "description": "Identifique o nome do agente se houver sido falado."
-                    },
-                    {
-                        "type": "string", 
-                        "title": "client",
-                        "description": "Identifique o nome do cliente se tiver sido falado"
-                    },
-                    {
-                        "type": "boolean",
-                        "title": "resolution", 
-                        "description": "O problema foi resolvido?"
-                    }
-                ]
-            }
-            
-            anonymize = {
-                "sequence": 3,
-                "entities": ["CNPJ", "CPF", "CREDIT_CARD", "LOCATION"]
-            }
-            
             url = f"{self.base_url}/asr/transcribe"
-            params = {
-                'model': 'pulse-precision',
-                'language': 'pt',
-                'response_format': 'diarization',
-                'insights': json.dumps(insights),
-                'anonymize': json.dumps(anonymize)
-            }
+            params = _CUSTOM_PARAMS
+        
+        # FFmpeg output is uploaded as chunked multipart so it never has to be
+        # buffered; audio already in memory or on disk is sent with a Content-Length
+        boundary = uuid.uuid4().hex
+        headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        
+        print(f"🚀 Sending to TalkIntel AI: {file_name}")
+        print(f"🔗 URL: {url}")
+        print(f"📋 Parameters: {params}")
+        
+        # Encoded once in memory with PyAV when available, so retries reuse it
+        use_av = av is not None
+        audio_data = None
         
         try:
-            # Open and send the converted file
-            with open(actual_file_path, 'rb') as audio_file:
-                files = {'file': (file_name, audio_file, 'audio/mpeg')}
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                if needs_conversion and use_av and audio_data is None:
+                    print(f"🔄 Converting audio with PyAV: {file_name}")
+                    try:
+                        audio_data = _transcode_inproc(audio_file_path, audio_format)
+                        print(f"✅ Audio converted successfully: {file_name}")
+                    except Exception as e:
+                        print(f"⚠️  PyAV conversion failed for {file_name} ({e}), falling back to FFmpeg")
+                        use_av = False
                 
-                print(f"🚀 Sending to TalkIntel AI...")
-                print(f"🔗 URL: {url}")
-                print(f"📋 Parameters: {params}")
-                
-                if params:
-                    response = self.session.post(
-                        url, 
-                        params=params,
-                        files=files,
-                        timeout=300  # 5 minutes timeout
-                    )
-                else:
-                    response = self.session.post(
-                        url, 
-                        files=files,
-                        timeout=300  # 5 minutes timeout
-                    )
-                
-                print(f"📡 Response Status: {response.status_code}")
+                ffmpeg = None
+                audio_stream = None
+                try:
+                    # FFmpeg only starts once the request may be sent, so its output
+                    # is never left waiting on the rate limit or a request slot
+                    if self._bucket:
+                        self._bucket.acquire()
+                    with self._inflight:
+                        mime = _ENCODINGS[audio_format]['mime']
+                        if audio_data is not None:
+                            upload = {'files': {'file': (file_name, audio_data, mime)}}
+                        elif needs_conversion:
+                            # FFmpeg output is streamed straight into the request, so each
+                            # attempt needs its own conversion
+                            ffmpeg = self.open_ffmpeg_stream(audio_file_path, audio_format)
+                            if not ffmpeg:
+                                print(f"❌ Failed to convert audio file: {audio_file_path}")
+                                return None
+                            
+                            # Don't spend a request on an empty upload
+                            first_chunk = ffmpeg.read(CHUNK_SIZE)
+                            if not first_chunk:
+                                ffmpeg.close()
+                                ffmpeg = None
+                                print(f"❌ FFmpeg produced no audio for: {audio_file_path}")
+                                return None
+                            upload = {
+                                'data': self._multipart_body(file_name, ffmpeg, boundary, mime, first_chunk),
+                                'headers': headers
+                            }
+                        else:
+                            audio_stream = open(audio_file_path, 'rb')
+                            upload = {'files': {'file': (file_name, audio_stream, mime)}}
+                        
+                        response = self.session.post(
+                            url, 
+                            params=params,
+                            timeout=300,  # 5 minutes timeout
+                            **upload
+                        )
+                except FFmpegError as e:
+                    # Reported with stderr by close_ffmpeg_stream below
+                    print(f"❌ Upload aborted for {file_name}: FFmpeg {e}")
+                    response = None
+                except requests.exceptions.ConnectionError as e:
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+                    print(f"⚠️  Connection failed for {file_name}: {e}")
+                    response = None
+                finally:
+                    if ffmpeg is not None:
+                        converted = self.close_ffmpeg_stream(ffmpeg)
+                    else:
+                        if audio_stream is not None:
+                            audio_stream.close()
+                        converted = True
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"✅ Transcription successful!")
-                    print(f"📊 Response keys: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}")
-                    # Clean up converted file
-                    if os.path.exists(converted_file):
-                        os.unlink(converted_file)
-                    return result
-                else:
-                    print(f"❌ Error: {response.status_code}")
-                    print(f"📄 Response: {response.text}")
-                    # Clean up converted file
-                    if os.path.exists(converted_file):
-                        os.unlink(converted_file)
+                if not converted:
+                    print(f"❌ Failed to convert audio file: {audio_file_path}")
                     return None
+                
+                if response is not None:
                     
+                    if response.status_code == 415 and audio_format != 'mp3':
+                        # Unsupported media type: retry once as MP3, and stay on MP3 for later files
+                        print(f"⚠️  Server rejected {audio_format.upper()} for {file_name}, falling back to MP3")
+                        self.audio_format = audio_format = 'mp3'
+                        needs_conversion = not self.is_target_format(audio_file_path, audio_format)
+                        audio_data = None
+                        continue
+                    
+                    if response.status_code not in RETRIABLE_STATUS or attempt == MAX_ATTEMPTS:
+                        break
+                    print(f"⚠️  Server returned {response.status_code} for {file_name}")
+                
+                delay = _backoff_delay(attempt, response)
+                print(f"⏳ Retrying {file_name} in {delay:.1f} seconds (attempt {attempt + 1}/{MAX_ATTEMPTS})...")
+                time.sleep(delay)
+            
+            print(f"📡 Response Status: {response.status_code} ({file_name})")
+            
+            if response.status_code == 200:
+                result = _json_loads(response.content)
+                print(f"✅ Transcription successful: {file_name}")
+                print(f"📊 Response keys: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}")
+                return result
+            else:
+                print(f"❌ Error: {response.status_code} ({file_name})")
+                print(f"📄 Response: {response.text}")
+                return None
+                
         except requests.exceptions.RequestException as e:
-            print(f"❌ Request failed: {e}")
-            # Clean up converted file
-            if os.path.exists(converted_file):
-                os.unlink(converted_file)
+            print(f"❌ Request failed for {file_name}: {e}")
             return None
         except Exception as e:
-            print(f"❌ Unexpected error: {e}")
-            # Clean up converted file
-            if os.path.exists(converted_file):
-                os.unlink(converted_file)
+            print(f"❌ Unexpected error for {file_name}: {e}")
             return None
     
-    def get_unique_files(self, directory_path: str) -> list:
+    def get_unique_files(self, directory_path: str, verbose: bool = False) -> list:
         """
         Get unique audio files, avoiding duplicates with different extensions
         Prioritizes MP3 > WAV > FLAC > M4A > OGG > WMA
         
         Args:
             directory_path: Path to directory containing audio files
+            verbose: Log which duplicates were skipped for each recording
             
         Returns:
             List of unique audio file paths
@@ -275,44 +657,90 @@ class TalkIntelTranscriber:
             print(f"❌ Directory not found: {directory_path}")
             return []
         
-        audio_extensions = ['.mp3', '.wav', '.flac', '.m4a', '.ogg', '.wma']
-        extension_priority = {ext: i for i, ext in enumerate(audio_extensions)}
+        # Single pass keeping only the best (priority, path, extension) per base name
+        best = {}
+        seen = defaultdict(list) if verbose else None
         
-        # Group files by base name (without extension)
-        file_groups = {}
+        for base_name, extension, path in _iter_audio(directory_path):
+            candidate = (_AUDIO_PRIORITY[extension], path, extension)
+            current = best.get(base_name)
+            if current is None or candidate < current:
+                best[base_name] = candidate
+            if seen is not None:
+                seen[base_name].append(extension)
         
-        for file_path in Path(directory_path).rglob('*'):
-            if file_path.is_file() and file_path.suffix.lower() in audio_extensions:
-                base_name = file_path.stem  # filename without extension
-                extension = file_path.suffix.lower()
-                
-                if base_name not in file_groups:
-                    file_groups[base_name] = []
-                
-                file_groups[base_name].append({
-                    'path': str(file_path),
-                    'extension': extension,
-                    'priority': extension_priority.get(extension, 999)
-                })
-        
-        # Select best file from each group (lowest priority number = higher preference)
-        unique_files = []
-        for base_name, files in file_groups.items():
-            # Sort by priority (MP3 first, then WAV, etc.)
-            files.sort(key=lambda x: x['priority'])
-            best_file = files[0]
-            unique_files.append(best_file['path'])
-            
-            # Log duplicates found
-            if len(files) > 1:
-                duplicate_extensions = [f['extension'] for f in files[1:]]
-                print(f"🔄 Found duplicates for '{base_name}': {duplicate_extensions} (using {best_file['extension']})")
+        # Log duplicates found
+        if seen is not None:
+            for base_name, extensions in seen.items():
+                if len(extensions) > 1:
+                    best_extension = best[base_name][2]
+                    extensions.remove(best_extension)
+                    print(f"🔄 Found duplicates for '{base_name}': {extensions} (using {best_extension})")
         
         # Sort final list alphabetically
-        unique_files.sort()
+        unique_files = sorted(entry[1] for entry in best.values())
         return unique_files
     
-    def process_directory(self, directory_path: str, webhook_endpoint: Optional[str] = None, max_files: Optional[int] = None) -> list:
+    def iter_transcriptions(self, audio_files: list, max_workers: Optional[int] = None):
+        """
+        Transcribe audio files concurrently, yielding results as they complete
+        
+        At most max_workers files are submitted at a time; a new one is
+        started as soon as any of them finishes, so the window stays full
+        without queueing a future for every file up front.
+        
+        Args:
+            audio_files: Paths of the audio files to transcribe
+            max_workers: Number of files converted and uploaded concurrently
+                (None for the value given to the constructor)
+            
+        Yields:
+            (path, transcription result or None) tuples in completion order
+        """
+        max_workers = max_workers or self.max_workers
+        if max_workers > self._pool_size:
+            self._size_pool(max_workers)
+        
+        remaining = iter(audio_files)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            for audio_file in remaining:
+                pending[executor.submit(self.transcribe_file, audio_file)] = audio_file
+                if len(pending) >= max_workers:
+                    break
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    audio_file = pending.pop(future)
+                    next_file = next(remaining, None)
+                    if next_file is not None:
+                        pending[executor.submit(self.transcribe_file, next_file)] = next_file
+                    yield audio_file, future.result()
+    
+    def transcribe_batch(self, audio_files: list, max_workers: Optional[int] = None) -> list:
+        """
+        Transcribe a batch of audio files concurrently
+        
+        The SipPulse API takes one file per request, so the batch is
+        pipelined over the shared session rather than sent as one upload.
+        
+        Args:
+            audio_files: Paths of the audio files to transcribe
+            max_workers: Number of files converted and uploaded concurrently
+                (None for the value given to the constructor)
+            
+        Returns:
+            List of (path, transcription result or None) tuples in the order of audio_files
+        """
+        completed = defaultdict(list)
+        for audio_file, result in self.iter_transcriptions(audio_files, max_workers):
+            completed[audio_file].append(result)
+        
+        # A path listed twice was transcribed twice; hand out one result per entry
+        return [(audio_file, completed[audio_file].pop(0)) for audio_file in audio_files]
+    
+    def process_directory(self, directory_path: str, webhook_endpoint: Optional[str] = None, max_files: Optional[int] = None, max_workers: Optional[int] = None, output_file: Optional[str] = None, verbose: bool = False) -> list:
         """
         Process unique audio files in a directory (avoiding duplicates with different extensions)
         
@@ -320,12 +748,17 @@ class TalkIntelTranscriber:
             directory_path: Path to directory containing audio files
             webhook_endpoint: Optional webhook endpoint to send results to
             max_files: Maximum number of files to process (None for all)
+            max_workers: Number of files converted and uploaded concurrently
+                (None for the value given to the constructor)
+            output_file: Optional JSON Lines file each result is appended to as it
+                completes; results written there are not kept in memory
+            verbose: Log which duplicates were skipped for each recording
             
         Returns:
-            List of successful transcription results
+            List of successful transcription results (empty when streamed to output_file)
         """
         # Get unique files (no duplicates)
-        unique_files = self.get_unique_files(directory_path)
+        unique_files = self.get_unique_files(directory_path, verbose=verbose)
         
         if not unique_files:
             print(f"❌ No unique audio files found in {directory_path}")
@@ -337,30 +770,56 @@ class TalkIntelTranscriber:
             unique_files = unique_files[:max_files]
             print(f"📝 Processing first {len(unique_files)} files")
         
+        max_workers = max_workers or self.max_workers
+        print(f"⚙️  Using {max_workers} workers")
+        
+        webhook_executor = None
+        if webhook_endpoint:
+            # Deliveries run in order on one background thread, so the next
+            # file is submitted without waiting for the webhook to answer
+            webhook_executor = ThreadPoolExecutor(max_workers=1)
+            webhook_slots = threading.BoundedSemaphore(WEBHOOK_QUEUE_SIZE)
+        
         results = []
-        for i, audio_file in enumerate(unique_files, 1):
-            print(f"\n{'='*60}")
-            print(f"🎯 Processing unique file {i}/{len(unique_files)}")
-            print(f"🎵 File: {os.path.basename(audio_file)}")
-            print(f"{'='*60}")
-            
-            result = self.transcribe_file(audio_file)
-            if result:
-                results.append({
-                    'file': audio_file,
-                    'transcription': result
-                })
+        succeeded = 0
+        output = None
+        try:
+            for i, (audio_file, result) in enumerate(self.iter_transcriptions(unique_files, max_workers), 1):
+                print(f"\n{'='*60}")
+                print(f"🎯 Finished unique file {i}/{len(unique_files)}")
+                print(f"🎵 File: {os.path.basename(audio_file)}")
+                print(f"{'='*60}")
                 
-                # Send to webhook if provided
-                if webhook_endpoint:
-                    self.send_to_webhook(result, webhook_endpoint)
-            
-            # Rate limiting - wait between requests
-            if i < len(unique_files):
-                print(f"⏳ Waiting 2 seconds before next file...")
-                time.sleep(2)
+                if result:
+                    succeeded += 1
+                    entry = {
+                        'file': audio_file,
+                        'transcription': result
+                    }
+                    
+                    if output_file:
+                        # Opened on first success so failed runs leave no empty file
+                        if output is None:
+                            output = open(output_file, 'ab')
+                        output.write(_json_dumps(entry) + b'\n')
+                        output.flush()
+                    else:
+                        results.append(entry)
+                    
+                    # Send to webhook if provided
+                    if webhook_executor:
+                        webhook_slots.acquire()
+                        delivery = webhook_executor.submit(self.send_to_webhook, result, webhook_endpoint)
+                        delivery.add_done_callback(lambda _: webhook_slots.release())
+        finally:
+            if webhook_executor:
+                print(f"⏳ Waiting for pending webhook deliveries...")
+                webhook_executor.shutdown(wait=True)
+            if output is not None:
+                output.close()
+                print(f"📁 Results saved to: {output_file}")
         
-        print(f"\n🎉 Processing complete! Successfully transcribed {len(results)}/{len(unique_files)} unique files")
+        print(f"\n🎉 Processing complete! Successfully transcribed {succeeded}/{len(unique_files)} unique files")
         return results
     
     def send_to_webhook(self, transcription_data: dict, webhook_endpoint: str) -> bool:
@@ -388,12 +847,27 @@ class TalkIntelTranscriber:
                 }
             }
             
-            response = requests.post(
-                webhook_endpoint,
-                json=webhook_payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=30
-            )
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                try:
+                    response = self.webhook_session.post(
+                        webhook_endpoint,
+                        data=_json_dumps(webhook_payload),
+                        headers={'Content-Type': 'application/json'},
+                        timeout=30
+                    )
+                except requests.exceptions.ConnectionError as e:
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+                    print(f"⚠️  Webhook connection failed: {e}")
+                    response = None
+                else:
+                    if response.status_code not in RETRIABLE_STATUS or attempt == MAX_ATTEMPTS:
+                        break
+                    print(f"⚠️  Webhook returned {response.status_code}")
+                
+                delay = _backoff_delay(attempt, response)
+                print(f"⏳ Retrying webhook in {delay:.1f} seconds (attempt {attempt + 1}/{MAX_ATTEMPTS})...")
+                time.sleep(delay)
             
             if response.status_code == 200:
                 print(f"✅ Webhook delivery successful")
@@ -407,6 +881,26 @@ class TalkIntelTranscriber:
             print(f"❌ Webhook error: {e}")
             return False
 
+def _positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def _non_negative_float(value: str) -> float:
+    """argparse type for rates where 0 means unlimited"""
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid float value: {value!r}")
+    if not math.isfinite(number) or number < 0:
+        raise argparse.ArgumentTypeError(f"must be a finite number of at least 0, got {value}")
+    return number
+
 def main():
     parser = argparse.ArgumentParser(description='TalkIntel AI Audio Transcription Utility')
     parser.add_argument('--directory', '-d', default='./TCR-Verbio', 
@@ -423,16 +917,38 @@ def main():
                         help='Use custom parameters instead of preset')
     parser.add_argument('--list-files', action='store_true',
                         help='Only list unique files, do not process them')
+    parser.add_argument('--max-workers', type=_positive_int, default=4,
+                        help='Number of files processed in parallel; workers beyond --concurrency wait '
+                             'for a request slot before starting FFmpeg (default: 4)')
+    parser.add_argument('--concurrency', '--max-inflight', dest='concurrency', type=_positive_int, default=4,
+                        help='Maximum simultaneous requests to TalkIntel AI, including the FFmpeg conversion '
+                             'streamed into each one; set to the provider quota (default: 4)')
+    parser.add_argument('--rate', type=_non_negative_float, default=0.5,
+                        help='Average requests per second sent to TalkIntel AI, bursts up to --concurrency '
+                             '(default: 0.5, 0 for unlimited)')
+    parser.add_argument('--audio-format', choices=sorted(_ENCODINGS), default='mp3',
+                        help='Format audio is converted to before upload (default: mp3); '
+                             'flac is lossless and falls back to mp3 if the server rejects it')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Log duplicate recordings skipped in favor of another format')
+    parser.add_argument('--json-array', action='store_true',
+                        help='Save results as one JSON array at the end instead of JSON Lines as they complete')
     
     args = parser.parse_args()
     
     # Initialize transcriber
-    transcriber = TalkIntelTranscriber(args.api_key)
+    transcriber = TalkIntelTranscriber(
+        args.api_key,
+        concurrency=args.concurrency,
+        max_workers=args.max_workers,
+        audio_format=args.audio_format,
+        rate_limit=args.rate
+    )
     
     if args.list_files:
         # Just list unique files without processing
         print("🔍 Scanning for unique audio files...")
-        unique_files = transcriber.get_unique_files(args.directory)
+        unique_files = transcriber.get_unique_files(args.directory, verbose=args.verbose)
         
         if unique_files:
             print(f"\n✅ Found {len(unique_files)} unique audio files:")
@@ -447,14 +963,10 @@ def main():
         print("🧪 Test mode: processing single file")
         
         # Find first audio file in directory
-        audio_extensions = {'.mp3', '.wav', '.flac', '.m4a', '.ogg', '.wma'}
         test_file = None
         
         if os.path.exists(args.directory):
-            audio_files = []
-            for file_path in Path(args.directory).rglob('*'):
-                if file_path.is_file() and file_path.suffix.lower() in audio_extensions:
-                    audio_files.append(str(file_path))
+            audio_files = [path for _, _, path in _iter_audio(args.directory)]
             
             # Sort by file extension to prioritize MP3 files 
             audio_files.sort(key=lambda x: (0 if x.endswith('.mp3') else 1, x))
@@ -481,18 +993,29 @@ def main():
             print(f"❌ No audio files found in {args.directory}")
     else:
         # Process all files
-        results = transcriber.process_directory(
-            args.directory, 
-            webhook_endpoint=args.webhook,
-            max_files=args.max_files
-        )
-        
-        # Save results to file
-        if results:
-            output_file = f"transcription_results_{int(time.time())}.json"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(results, f, indent=2, ensure_ascii=False)
-            print(f"📁 Results saved to: {output_file}")
+        if args.json_array:
+            results = transcriber.process_directory(
+                args.directory, 
+                webhook_endpoint=args.webhook,
+                max_files=args.max_files,
+                verbose=args.verbose
+            )
+            
+            # Save results to file
+            if results:
+                output_file = f"transcription_results_{int(time.time())}.json"
+                with open(output_file, 'wb') as f:
+                    f.write(_json_dumps(results, indent=True))
+                print(f"📁 Results saved to: {output_file}")
+        else:
+            # Results are appended as JSON Lines while the batch runs
+            transcriber.process_directory(
+                args.directory, 
+                webhook_endpoint=args.webhook,
+                max_files=args.max_files,
+                output_file=f"transcription_results_{int(time.time())}.jsonl",
+                verbose=args.verbose
+            )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file